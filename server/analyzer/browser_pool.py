@@ -0,0 +1,229 @@
+"""Long-lived Chromium instance shared by analyses inside the Playwright helper process."""
+
+import os
+import asyncio
+import logging
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Pinned axe-core build. setup_playwright.py downloads it to AXE_PATH so it can be
+# preloaded into every context; the CDN is only used when the local copy is missing.
+AXE_CDN_URL = "https://cdnjs.cloudflare.com/ajax/libs/axe-core/4.8.2/axe.min.js"
+AXE_PATH = Path(os.environ.get("AXE_CORE_PATH", Path(__file__).parent / "vendor" / "axe.min.js"))
+
+# Read once at import; None when the bundle hasn't been downloaded
+AXE_SRC = AXE_PATH.read_text(encoding="utf-8") if AXE_PATH.exists() else None
+
+# Installed in every context next to axe; playwright_helper calls it with the
+# WCAG tags and the longest node HTML to keep
+AXE_RUNNER_SRC = """
+window.__runAxe = (tags, maxHtml) => axe.run(document, {
+    runOnly: { type: 'tag', values: tags },
+    // Full node details only where the report shows them;
+    // passes/inapplicable keep one node per rule
+    resultTypes: ['violations', 'incomplete']
+}).then(results => {
+    // Cap HTML snippets so huge subtrees don't bloat the payload
+    const trim = html => html && html.length > maxHtml ? html.slice(0, maxHtml) + '...' : html;
+    for (const type of ['violations', 'incomplete', 'passes', 'inapplicable']) {
+        for (const rule of results[type] || []) {
+            for (const node of rule.nodes) {
+                node.html = trim(node.html);
+                for (const check of [...(node.any || []), ...(node.all || []), ...(node.none || [])]) {
+                    for (const related of check.relatedNodes || []) {
+                        related.html = trim(related.html);
+                    }
+                }
+            }
+        }
+    }
+    return results;
+});
+"""
+
+# Optional CDP endpoint of an externally managed Chromium (e.g. a shared browser
+# container). When set, the pool connects to it instead of launching its own.
+CDP_ENDPOINT = os.environ.get("PLAYWRIGHT_CDP_ENDPOINT")
+
+# Contexts a launched Chromium serves before it is replaced by a fresh one, which
+# returns memory the renderer leaks over time (0 disables recycling)
+BROWSER_RECYCLE_AFTER = int(os.environ.get("PLAYWRIGHT_BROWSER_RECYCLE_AFTER", "200"))
+
+# Default timeout (ms) for waits and actions on every page of a context, so any
+# wait without an explicit timeout (e.g. the CDN axe load) can't outlive it.
+# page.evaluate takes no timeout; playwright_helper bounds whole analyses with
+# PLAYWRIGHT_ANALYSIS_TIMEOUT instead.
+PAGE_DEFAULT_TIMEOUT_MS = int(os.environ.get("PLAYWRIGHT_PAGE_TIMEOUT_MS", "30000"))
+
+# Resources axe never looks at (it inspects the DOM and computed styles, not pixels)
+BLOCKED_RESOURCE_TYPES = frozenset({"image", "media", "font"})
+
+# Launch args for deployment environments
+BROWSER_ARGS = [
+    '--no-sandbox',
+    '--disable-dev-shm-usage',
+    '--disable-gpu',
+    '--disable-web-security',
+    '--disable-features=VizDisplayCompositor',
+    '--no-first-run',
+    '--disable-extensions',
+    '--disable-default-apps'
+]
+
+async def block_heavy_resources(route):
+    """Route handler that aborts image, media and font downloads."""
+    if route.request.resource_type in BLOCKED_RESOURCE_TYPES:
+        await route.abort()
+    else:
+        await route.continue_()
+
+class BrowserPool:
+    """
+    Owns one Playwright driver and one Chromium process for the lifetime of
+    the helper. Each analysis gets a fresh, isolated BrowserContext; only the
+    context is closed afterwards, so browser start-up is paid once. Contexts
+    are independent, so several analyses can run concurrently on one browser.
+
+    A launched browser is replaced after BROWSER_RECYCLE_AFTER contexts; the
+    old one is closed once its last in-flight context is released.
+    """
+
+    def __init__(self):
+        self._playwright = None
+        self._browser = None
+        # Serializes start() so concurrent analyses don't launch two browsers
+        self._start_lock = asyncio.Lock()
+        # Contexts created on the current browser
+        self._served = 0
+        # Open contexts per browser (replaced browsers stay here until their
+        # contexts are released) and the browser each context belongs to
+        self._open_contexts = {}
+        self._context_browser = {}
+
+    async def start(self):
+        """Start Playwright and launch (or connect to) Chromium if not running or disconnected."""
+        async with self._start_lock:
+            if self._playwright is None:
+                # Imported on first launch so requests that fail validation (and
+                # setup_playwright.py, which only needs the axe constants) skip it
+                from playwright.async_api import async_playwright
+                self._playwright = await async_playwright().start()
+            if (self._browser is not None and not CDP_ENDPOINT
+                    and BROWSER_RECYCLE_AFTER and self._served >= BROWSER_RECYCLE_AFTER):
+                logger.info(f"Recycling browser after {self._served} contexts")
+                browser, self._browser = self._browser, None
+                if not self._open_contexts.get(browser):
+                    await self._close_browser(browser)
+            if self._browser is None or not self._browser.is_connected():
+                if self._browser is not None:
+                    # Crashed or disconnected: forget it now unless contexts
+                    # still need release() to close it
+                    browser, self._browser = self._browser, None
+                    if not self._open_contexts.get(browser):
+                        await self._close_browser(browser)
+                if CDP_ENDPOINT:
+                    logger.info(f"Connecting to Chromium over CDP at {CDP_ENDPOINT}...")
+                    self._browser = await self._playwright.chromium.connect_over_cdp(CDP_ENDPOINT)
+                    logger.info("Connected to shared browser")
+                else:
+                    logger.info("Launching Chromium browser...")
+                    self._browser = await self._playwright.chromium.launch(
+                        headless=True,
+                        args=BROWSER_ARGS
+                    )
+                    logger.info("Browser launched successfully")
+                self._served = 0
+            return self._browser
+
+    async def acquire_page(self, block_assets: bool = True):
+        """
+        Create a fresh context and page for one analysis.
+
+        Args:
+            block_assets (bool): Abort image, media and font downloads
+
+        Returns:
+            tuple: (context, page); pass the context to release() when done
+        """
+        browser = await self.start()
+
+        logger.info("Creating browser context...")
+        context = await browser.new_context(viewport={'width': 1280, 'height': 720})
+        self._served += 1
+        self._open_contexts[browser] = self._open_contexts.get(browser, 0) + 1
+        self._context_browser[context] = browser
+        try:
+            # Applies to every page the context opens
+            context.set_default_timeout(PAGE_DEFAULT_TIMEOUT_MS)
+
+            # Preload the local axe-core bundle so it is defined before page scripts run
+            if AXE_SRC:
+                await context.add_init_script(script=AXE_SRC)
+            # axe.run wrapper; it looks axe up when called, so it also works
+            # with the CDN fallback
+            await context.add_init_script(script=AXE_RUNNER_SRC)
+
+            # Skip downloads that don't affect the analysis
+            if block_assets:
+                await context.route("**/*", block_heavy_resources)
+
+            page = await context.new_page()
+        except Exception:
+            await self.release(context)
+            raise
+        return context, page
+
+    async def warm_up(self):
+        """
+        Launch the browser and run axe once on a blank page, so the first real
+        request doesn't pay for browser start-up and the first axe run. Failures
+        are only logged; the next acquire_page retries the launch.
+        """
+        try:
+            context, page = await self.acquire_page()
+        except Exception as e:
+            logger.warning(f"Browser warm-up failed: {e}")
+            return
+        try:
+            await page.set_content("<!DOCTYPE html><html lang='en'><title>warm-up</title></html>")
+            if AXE_SRC:
+                await page.evaluate("() => window.__runAxe(['wcag2a'], 0)")
+            logger.info("Browser warmed up")
+        except Exception as e:
+            logger.warning(f"Browser warm-up failed: {e}")
+        finally:
+            await self.release(context)
+
+    async def release(self, context):
+        """Close a context returned by acquire_page (this also closes its pages)."""
+        logger.info("Cleaning up browser context...")
+        try:
+            await context.close()
+        finally:
+            browser = self._context_browser.pop(context)
+            self._open_contexts[browser] -= 1
+            # A replaced (recycled or crashed) browser goes once its last context does
+            if not self._open_contexts[browser] and browser is not self._browser:
+                await self._close_browser(browser)
+
+    async def _close_browser(self, browser):
+        """Close a browser that is no longer current and forget its bookkeeping."""
+        self._open_contexts.pop(browser, None)
+        try:
+            if browser.is_connected():
+                await browser.close()
+        except Exception as e:
+            logger.warning(f"Failed to close browser: {e}")
+
+    async def close(self):
+        """Close the browser (or disconnect from a shared one) and stop Playwright."""
+        for browser in list(self._open_contexts):
+            if browser is not self._browser:
+                await self._close_browser(browser)
+        if self._browser is not None and self._browser.is_connected():
+            await self._browser.close()
+        self._browser = None
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
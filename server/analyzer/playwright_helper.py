@@ -1,10 +1,72 @@
 #!/usr/bin/env python
 # playwright_helper.py - Runs Playwright in a separate process
+#
+# Two modes:
+#   python playwright_helper.py            one-shot: read one JSON request from stdin,
+#                                          launch a browser, print one JSON result
+#   python playwright_helper.py --serve    long-lived worker: keep one browser open and
+#                                          answer length-prefixed JSON frames on stdin/stdout,
+#                                          several requests at a time
+#
+# Browser lifecycle lives in browser_pool.py (importable because this script's
+# directory is on sys.path when it is run).
 
 import sys
-import json
-from typing import Dict, Any, List
-from playwright.sync_api import sync_playwright
+import asyncio
+import logging
+import os
+import struct
+from typing import Dict, Any, List, Optional
+import orjson
+from browser_pool import BrowserPool, AXE_CDN_URL, AXE_SRC, AXE_RUNNER_SRC
+
+logger = logging.getLogger(__name__)
+
+# --serve framing: 4-byte big-endian payload length, then UTF-8 JSON
+FRAME_HEADER = struct.Struct(">I")
+
+# Analyses a --serve worker runs at once, each in its own browser context
+MAX_CONCURRENT_ANALYSES = int(os.environ.get("PLAYWRIGHT_MAX_CONCURRENCY", "4"))
+
+# Seconds one analysis may take once it has a slot. page.evaluate has no timeout
+# of its own, so a page that keeps its main thread busy would otherwise hold the
+# slot (and its context) forever.
+ANALYSIS_TIMEOUT = float(os.environ.get("PLAYWRIGHT_ANALYSIS_TIMEOUT", "120"))
+
+# Largest DOM (element count) that will be analyzed
+MAX_DOM_NODES = int(os.environ.get("ANALYZER_MAX_DOM_NODES", "100000"))
+
+# Longest element HTML snippet returned per result node
+MAX_NODE_HTML = 500
+
+# Calls the axe runner installed by BrowserPool (see browser_pool.AXE_RUNNER_SRC);
+# tags and the HTML cap are passed as arguments, so the source never changes
+RUN_AXE_JS = "([tags, maxHtml]) => window.__runAxe(tags, maxHtml)"
+
+# Resolves when the page's main thread is idle, or after the budget expires
+IDLE_PROBE_TIMEOUT_MS = 500
+IDLE_PROBE_JS = """timeout => new Promise(resolve => {
+    if ('requestIdleCallback' in window) {
+        requestIdleCallback(() => resolve(), { timeout });
+    } else {
+        setTimeout(resolve, timeout);
+    }
+})"""
+
+# axe-core tags for each (version, level). Later WCAG versions include the
+# earlier ones, and higher levels include the lower ones.
+WCAG_TAG_TABLE = {
+    ("wcag2", "a"): ("wcag2a",),
+    ("wcag2", "aa"): ("wcag2a", "wcag2aa"),
+    ("wcag2", "aaa"): ("wcag2a", "wcag2aa", "wcag2aaa"),
+    ("wcag21", "a"): ("wcag2a", "wcag21a"),
+    ("wcag21", "aa"): ("wcag2a", "wcag2aa", "wcag21a", "wcag21aa"),
+    ("wcag21", "aaa"): ("wcag2a", "wcag2aa", "wcag2aaa", "wcag21a", "wcag21aa", "wcag21aaa"),
+    ("wcag22", "a"): ("wcag2a", "wcag21a", "wcag22a"),
+    ("wcag22", "aa"): ("wcag2a", "wcag2aa", "wcag21a", "wcag21aa", "wcag22a", "wcag22aa"),
+    ("wcag22", "aaa"): ("wcag2a", "wcag2aa", "wcag2aaa", "wcag21a", "wcag21aa", "wcag21aaa",
+                        "wcag22a", "wcag22aa", "wcag22aaa"),
+}
 
 def get_wcag_tags(wcag_options: Dict[str, Any]) -> List[str]:
     """
@@ -16,63 +78,15 @@ def get_wcag_tags(wcag_options: Dict[str, Any]) -> List[str]:
     Returns:
         list: List of axe-core tags to include with strict version and level selection
     """
-    tags = []
-    
     # Get the selected version and level
     version = wcag_options.get("wcag_version", "wcag2")
     level = wcag_options.get("level", "aa").lower()
     
-    # Process WCAG 2.0 tags
-    if version == "wcag2":
-        # Only include level A tags
-        tags.append("wcag2a")
-        
-        # Add AA tags only if level is AA or AAA
-        if level in ["aa", "aaa"]:
-            tags.append("wcag2aa")
-        
-        # Add AAA tags only if level is AAA
-        if level == "aaa":
-            tags.append("wcag2aaa")
-    
-    # Process WCAG 2.1 tags (includes 2.0)
-    elif version == "wcag21":
-        # WCAG 2.0 tags (included in 2.1)
-        tags.append("wcag2a")
-        if level in ["aa", "aaa"]:
-            tags.append("wcag2aa")
-        if level == "aaa":
-            tags.append("wcag2aaa")
-            
-        # WCAG 2.1 specific tags
-        tags.append("wcag21a")
-        if level in ["aa", "aaa"]:
-            tags.append("wcag21aa")
-        if level == "aaa":
-            tags.append("wcag21aaa")
+    # Unrecognised levels only get level A tags
+    if level not in ("aa", "aaa"):
+        level = "a"
     
-    # Process WCAG 2.2 tags (includes 2.0 and 2.1)
-    elif version == "wcag22":
-        # WCAG 2.0 tags (included in 2.2)
-        tags.append("wcag2a")
-        if level in ["aa", "aaa"]:
-            tags.append("wcag2aa")
-        if level == "aaa":
-            tags.append("wcag2aaa")
-            
-        # WCAG 2.1 tags (included in 2.2)
-        tags.append("wcag21a")
-        if level in ["aa", "aaa"]:
-            tags.append("wcag21aa")
-        if level == "aaa":
-            tags.append("wcag21aaa")
-            
-        # WCAG 2.2 specific tags
-        tags.append("wcag22a")
-        if level in ["aa", "aaa"]:
-            tags.append("wcag22aa")
-        if level == "aaa":
-            tags.append("wcag22aaa")
+    tags = list(WCAG_TAG_TABLE.get((version, level), ()))
     
     # Include best practices if requested
     if wcag_options.get("best_practice", True):
@@ -98,150 +112,178 @@ def max_level(level1: str, level2: str) -> str:
     level_rank = {"none": 0, "a": 1, "aa": 2, "aaa": 3}
     return level1 if level_rank.get(level1, 0) >= level_rank.get(level2, 0) else level2
 
+def browser_error_result(browser_error: Exception) -> Dict[str, Any]:
+    """Build the error result returned when Chromium cannot be launched."""
+    logger.error(f"Failed to launch browser: {browser_error}")
+    return {
+        "success": False,
+        "error": f"Browser launch failed: {str(browser_error)}",
+        "mode": "static_only",
+        "browser_error": True
+    }
+
+async def analyze_with_pool(pool: BrowserPool, data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Analyze a single URL (or raw HTML document) in a fresh context from the pool.
+
+    The context is always released afterwards; the browser stays open so the
+    pool can serve the next request.
+
+    Args:
+        pool (BrowserPool): Pool owning the browser
+        data (dict): Request with "url" or "html", and optional "wcag_options"
+
+    Returns:
+        dict: Analysis results
+    """
+    url = data.get("url")
+    html = data.get("html")
+    if not url and html is None:
+        return {
+            "success": False,
+            "error": "No URL provided",
+            "mode": "static_only"
+        }
+
+    wcag_options = data.get("wcag_options") or {}
+    tags = get_wcag_tags(wcag_options)
+
+    logger.info(f"Starting analysis for {'HTML content' if html is not None else f'URL: {url}'}")
+    logger.info(f"Using WCAG tags: {tags}")
+
+    # Create context and page (launches the browser on first use)
+    try:
+        context, page = await pool.acquire_page(wcag_options.get("block_assets", True))
+    except Exception as browser_error:
+        return browser_error_result(browser_error)
+
+    try:
+        # Navigate to URL; axe analyzes the current DOM, so there is no need to
+        # wait for the network to go idle (long-polling pages never do).
+        # Raw HTML is written straight into the page instead of a data: URL.
+        try:
+            if html is not None:
+                logger.info("Loading HTML content")
+                await page.set_content(html, wait_until="domcontentloaded", timeout=30000)
+            else:
+                logger.info(f"Navigating to URL: {url}")
+                await page.goto(url, wait_until="domcontentloaded", timeout=30000)
+            logger.info("Page loaded successfully")
+        except Exception as nav_error:
+            logger.error(f"Navigation failed: {nav_error}")
+            return {
+                "success": False,
+                "error": f"Navigation failed: {str(nav_error)}",
+                "mode": "static_only",
+                "navigation_error": True
+            }
+
+        # Give the page a bounded chance to finish loading before analyzing it
+        logger.info("Waiting for page to settle...")
+        try:
+            await page.wait_for_load_state("load", timeout=10000)
+        except Exception:
+            logger.warning("Page did not finish loading in time, analyzing current DOM")
+
+        # Let scripts that render on load run once the main thread goes idle
+        # (capped, since pages with busy timers never go idle)
+        try:
+            await page.evaluate(IDLE_PROBE_JS, IDLE_PROBE_TIMEOUT_MS)
+        except Exception:
+            logger.warning("Idle probe failed, analyzing current DOM")
+
+        # SPAs can name an element that signals their content has rendered
+        wait_selector = wcag_options.get("wait_selector")
+        if wait_selector:
+            try:
+                await page.wait_for_selector(wait_selector, timeout=5000)
+            except Exception:
+                logger.warning(f"Selector {wait_selector!r} did not appear, analyzing current DOM")
+
+        # Refuse pathologically large documents before axe spends minutes on them
+        node_count = await page.evaluate("document.getElementsByTagName('*').length")
+        if node_count > MAX_DOM_NODES:
+            logger.warning(f"Page has {node_count} elements, over the {MAX_DOM_NODES} element budget")
+            return {
+                "success": False,
+                "error": f"Page too large to analyze: {node_count} elements (limit {MAX_DOM_NODES})",
+                "mode": "static_only",
+                "page_too_large": True
+            }
+
+        # Inject Axe (and its runner) unless the init scripts already provided them
+        try:
+            loaded = await page.evaluate("({ axe: typeof axe !== 'undefined', runner: typeof window.__runAxe === 'function' })")
+            if not loaded["axe"]:
+                # Prefer the bundle already in memory; the CDN is only for
+                # installs where it was never downloaded
+                if AXE_SRC:
+                    logger.info("Injecting local axe-core bundle...")
+                    await page.add_script_tag(content=AXE_SRC)
+                else:
+                    logger.info("Injecting axe-core library from CDN...")
+                    await page.add_script_tag(url=AXE_CDN_URL)
+                # Wait for axe to load
+                await page.wait_for_function("typeof axe !== 'undefined'")
+            if not loaded["runner"]:
+                await page.add_script_tag(content=AXE_RUNNER_SRC)
+            logger.info("Axe-core loaded successfully")
+        except Exception as axe_error:
+            logger.error(f"Failed to load axe-core: {axe_error}")
+            return {
+                "success": False,
+                "error": f"Failed to load axe-core: {str(axe_error)}",
+                "mode": "static_only",
+                "axe_error": True
+            }
+
+        # Run Axe analysis with selected tags
+        logger.info(f"Running axe analysis with tags: {tags}")
+        try:
+            results = await page.evaluate(RUN_AXE_JS, [tags, MAX_NODE_HTML])
+            logger.info(f"Analysis completed. Found {len(results.get('violations', []))} violations")
+        except Exception as analysis_error:
+            logger.error(f"Axe analysis failed: {analysis_error}")
+            return {
+                "success": False,
+                "error": f"Axe analysis failed: {str(analysis_error)}",
+                "mode": "static_only",
+                "analysis_error": True
+            }
+
+        return {
+            "success": True,
+            "results": results,
+            "mode": "full",
+            "tags_used": tags,
+            "violations_count": len(results.get('violations', []))
+        }
+    finally:
+        await pool.release(context)
+
+async def analyze_once(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Analyze one URL with a pool that is closed afterwards."""
+    pool = BrowserPool()
+    try:
+        return await analyze_with_pool(pool, data)
+    finally:
+        await pool.close()
+
 def run_analysis(data: Dict[str, Any]):
-    import logging
-    import os
-    
-    # Set up logging
+    """One-shot analysis: launch a browser, analyze one URL and close the browser."""
     logging.basicConfig(level=logging.INFO)
-    logger = logging.getLogger(__name__)
-    
+
     try:
-        url = data.get("url")
-        if not url:
+        if not data.get("url") and data.get("html") is None:
             return {
                 "success": False,
                 "error": "No URL provided",
                 "mode": "static_only"
             }
-        
-        wcag_options = data.get("wcag_options", {})
-        tags = get_wcag_tags(wcag_options)
-        
-        logger.info(f"Starting analysis for URL: {url}")
-        logger.info(f"Using WCAG tags: {tags}")
+
         logger.info(f"Environment: PLAYWRIGHT_BROWSERS_PATH={os.environ.get('PLAYWRIGHT_BROWSERS_PATH', 'Not set')}")
-        
-        with sync_playwright() as p:
-            # Launch browser with additional args for deployment environments
-            browser_args = [
-                '--no-sandbox',
-                '--disable-dev-shm-usage',
-                '--disable-gpu',
-                '--disable-web-security',
-                '--disable-features=VizDisplayCompositor',
-                '--no-first-run',
-                '--disable-extensions',
-                '--disable-default-apps'
-            ]
-            
-            logger.info("Launching Chromium browser...")
-            try:
-                browser = p.chromium.launch(
-                    headless=True,
-                    args=browser_args
-                )
-                logger.info("Browser launched successfully")
-            except Exception as browser_error:
-                logger.error(f"Failed to launch browser: {browser_error}")
-                return {
-                    "success": False,
-                    "error": f"Browser launch failed: {str(browser_error)}",
-                    "mode": "static_only",
-                    "browser_error": True
-                }
-            
-            # Create context and page
-            logger.info("Creating browser context...")
-            context = browser.new_context(viewport={'width': 1280, 'height': 720})
-            page = context.new_page()
-            
-            # Navigate to URL with better timing for consistency
-            logger.info(f"Navigating to URL: {url}")
-            try:
-                page.goto(url, wait_until="networkidle", timeout=60000)
-                logger.info("Page loaded successfully")
-            except Exception as nav_error:
-                logger.error(f"Navigation failed: {nav_error}")
-                page.close()
-                context.close()
-                browser.close()
-                return {
-                    "success": False,
-                    "error": f"Navigation failed: {str(nav_error)}",
-                    "mode": "static_only",
-                    "navigation_error": True
-                }
-            
-            # Wait for JavaScript to settle and dynamic content to load
-            logger.info("Waiting for page to settle...")
-            page.wait_for_timeout(2000)
-            page.wait_for_load_state("networkidle")
-            
-            # Inject Axe
-            logger.info("Injecting axe-core library...")
-            try:
-                page.add_script_tag(
-                    url="https://cdnjs.cloudflare.com/ajax/libs/axe-core/4.8.2/axe.min.js"
-                )
-                # Wait for axe to load
-                page.wait_for_function("typeof axe !== 'undefined'")
-                logger.info("Axe-core loaded successfully")
-            except Exception as axe_error:
-                logger.error(f"Failed to load axe-core: {axe_error}")
-                page.close()
-                context.close()
-                browser.close()
-                return {
-                    "success": False,
-                    "error": f"Failed to load axe-core: {str(axe_error)}",
-                    "mode": "static_only",
-                    "axe_error": True
-                }
-            
-            # Run Axe analysis with selected tags
-            logger.info(f"Running axe analysis with tags: {tags}")
-            try:
-                results = page.evaluate(f"""() => {{
-                    return new Promise((resolve, reject) => {{
-                        try {{
-                            axe.run(document, {{
-                                runOnly: {{
-                                    type: 'tag',
-                                    values: {json.dumps(tags)}
-                                }}
-                            }}).then(resolve).catch(reject);
-                        }} catch (error) {{
-                            reject(error);
-                        }}
-                    }});
-                }}""")
-                logger.info(f"Analysis completed. Found {len(results.get('violations', []))} violations")
-            except Exception as analysis_error:
-                logger.error(f"Axe analysis failed: {analysis_error}")
-                page.close()
-                context.close()
-                browser.close()
-                return {
-                    "success": False,
-                    "error": f"Axe analysis failed: {str(analysis_error)}",
-                    "mode": "static_only",
-                    "analysis_error": True
-                }
-            
-            # Close everything
-            logger.info("Cleaning up browser resources...")
-            page.close()
-            context.close()
-            browser.close()
-            
-            return {
-                "success": True,
-                "results": results,
-                "mode": "full",
-                "tags_used": tags,
-                "violations_count": len(results.get('violations', []))
-            }
+
+        return asyncio.run(analyze_once(data))
     except Exception as e:
         import traceback
         return {
@@ -251,31 +293,118 @@ def run_analysis(data: Dict[str, Any]):
             "mode": "static_only"
         }
 
+def write_result(result: Dict[str, Any]):
+    """Write one result to stdout as a single line of UTF-8 JSON."""
+    sys.stdout.buffer.write(orjson.dumps(result) + b"\n")
+    sys.stdout.buffer.flush()
+
+def read_frame(stream) -> Optional[bytes]:
+    """Read one length-prefixed frame; None when the stream is closed."""
+    header = stream.read(FRAME_HEADER.size)
+    if len(header) < FRAME_HEADER.size:
+        return None
+    (length,) = FRAME_HEADER.unpack(header)
+    payload = stream.read(length)
+    if len(payload) < length:
+        return None
+    return payload
+
+def write_frame(stream, payload: bytes):
+    """Write one length-prefixed frame and flush it."""
+    stream.write(FRAME_HEADER.pack(len(payload)) + payload)
+    stream.flush()
+
+async def serve_request(pool: BrowserPool, semaphore: asyncio.Semaphore, request: bytes):
+    """Analyze one framed request and write its framed reply, tagged with the request id."""
+    request_id = None
+    try:
+        data = orjson.loads(request)
+        request_id = data.get("id")
+        async with semaphore:
+            # Cancelling the analysis still runs its finally, which releases the context
+            result = await asyncio.wait_for(analyze_with_pool(pool, data), ANALYSIS_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.error(f"Analysis timed out after {ANALYSIS_TIMEOUT:g} seconds")
+        result = {
+            "success": False,
+            "error": f"Analysis timed out after {ANALYSIS_TIMEOUT:g} seconds",
+            "mode": "static_only"
+        }
+    except Exception as e:
+        import traceback
+        result = {
+            "success": False,
+            "error": str(e),
+            "traceback": traceback.format_exc(),
+            "mode": "static_only"
+        }
+    # Only the event loop thread writes to stdout, so frames never interleave
+    write_frame(sys.stdout.buffer, orjson.dumps({"id": request_id, "result": result}))
+
+async def serve():
+    """
+    Run as a long-lived worker: framed JSON requests on stdin, framed JSON
+    replies on stdout. Up to MAX_CONCURRENT_ANALYSES requests are analyzed at
+    once, each in its own context of the shared browser, so replies can arrive
+    out of order and carry the id of their request. Chromium is launched and
+    warmed up at start (and relaunched if it crashes). Exits when stdin is
+    closed, after the analyses in flight have finished.
+    """
+    logging.basicConfig(level=logging.INFO)
+    logger.info(f"Environment: PLAYWRIGHT_BROWSERS_PATH={os.environ.get('PLAYWRIGHT_BROWSERS_PATH', 'Not set')}")
+
+    loop = asyncio.get_running_loop()
+    pool = BrowserPool()
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_ANALYSES)
+    tasks = set()
+    try:
+        # Warm the browser while waiting for the first request; that request
+        # waits on the pool's start lock if it arrives before the launch is done
+        warm_up = asyncio.create_task(pool.warm_up())
+        tasks.add(warm_up)
+        warm_up.add_done_callback(tasks.discard)
+        while True:
+            # Blocking pipe reads stay off the event loop (asyncio pipes differ on Windows)
+            request = await loop.run_in_executor(None, read_frame, sys.stdin.buffer)
+            if request is None:
+                break
+            task = asyncio.create_task(serve_request(pool, semaphore, request))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+    finally:
+        await pool.close()
+
 if __name__ == "__main__":
+    if "--serve" in sys.argv[1:]:
+        asyncio.run(serve())
+        sys.exit(0)
+
     try:
         # Read input from stdin
-        input_data = sys.stdin.read()
+        input_data = sys.stdin.buffer.read()
         if not input_data:
             # Fallback to command line argument for backward compatibility
             if len(sys.argv) > 1:
                 data = {"url": sys.argv[1]}
             else:
-                print(json.dumps({
+                write_result({
                     "success": False,
                     "error": "No input data provided",
                     "mode": "static_only"
-                }))
+                })
                 sys.exit(1)
         else:
-            data = json.loads(input_data)
-        
+            data = orjson.loads(input_data)
+
         result = run_analysis(data)
-        print(json.dumps(result))
+        write_result(result)
     except Exception as e:
         import traceback
-        print(json.dumps({
+        write_result({
             "success": False,
             "error": str(e),
             "traceback": traceback.format_exc(),
             "mode": "static_only"
-        })) 
\ No newline at end of file
+        })
@@ -1,11 +1,17 @@
 """Simple Playwright analyzer for accessibility testing that avoids asyncio issues on Windows."""
 
+import os
 import sys
+import time
 import logging
-import json
+import struct
+import itertools
 import subprocess
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
 from pathlib import Path
 from typing import Dict, Any, Optional
+import orjson
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -14,19 +20,203 @@ logger = logging.getLogger(__name__)
 # Path to the helper script that will run in a separate process
 HELPER_SCRIPT = Path(__file__).parent / "playwright_helper.py"
 
-def analyze_url(url: str, wcag_options: Optional[Dict[str, Any]] = None):
+# Long-lived helper process (started lazily) that keeps one browser open.
+# Requests and results are length-prefixed JSON frames on its binary stdin/stdout
+# (see playwright_helper.read_frame). Each request carries an id and the helper
+# runs several at once, so a reader thread hands replies to the waiting callers.
+FRAME_HEADER = struct.Struct(">I")
+_worker: Optional["HelperWorker"] = None
+_worker_lock = threading.Lock()
+_request_ids = itertools.count(1)
+
+# Seconds without requests after which the worker (and its browser) is stopped; 0 disables
+WORKER_IDLE_TIMEOUT = float(os.environ.get("PLAYWRIGHT_WORKER_IDLE_TIMEOUT", "300"))
+_idle_timer: Optional[threading.Timer] = None
+_last_used = 0.0
+
+# Seconds a request waits without the worker replying to anything before the
+# worker is treated as hung and replaced. The helper gives up on each analysis
+# after PLAYWRIGHT_ANALYSIS_TIMEOUT, so a healthy worker replies well within this.
+WORKER_REPLY_TIMEOUT = float(os.environ.get("PLAYWRIGHT_WORKER_REPLY_TIMEOUT", "180"))
+
+class HelperWorker:
+    """A running `playwright_helper.py --serve` process and its in-flight requests."""
+
+    def __init__(self):
+        cmd = [sys.executable, str(HELPER_SCRIPT), "--serve"]
+        logger.info(f"Starting helper worker: {' '.join(cmd)}")
+        # stderr is inherited so the helper's logs end up in the server log
+        self.process = subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE
+        )
+        # request id -> Future resolved with the raw result JSON, or None if the worker died
+        self.pending: Dict[int, Future] = {}
+        self._pending_lock = threading.Lock()
+        # time.monotonic() of the latest reply (or of the start)
+        self.last_reply = time.monotonic()
+        self._reader = threading.Thread(target=self._read_replies, daemon=True)
+        self._reader.start()
+
+    def alive(self) -> bool:
+        return self.process.poll() is None and self._reader.is_alive()
+
+    def send(self, request: Dict[str, Any]) -> Future:
+        """Write one request frame and return the Future its reply resolves. Caller holds _worker_lock."""
+        future = Future()
+        with self._pending_lock:
+            self.pending[request["id"]] = future
+        payload = orjson.dumps(request)
+        try:
+            self.process.stdin.write(FRAME_HEADER.pack(len(payload)) + payload)
+            self.process.stdin.flush()
+        except Exception:
+            with self._pending_lock:
+                self.pending.pop(request["id"], None)
+            raise
+        return future
+
+    def _read_replies(self):
+        """Reader thread: resolve pending requests as their replies arrive."""
+        stdout = self.process.stdout
+        while True:
+            header = stdout.read(FRAME_HEADER.size)
+            if len(header) < FRAME_HEADER.size:
+                break
+            (length,) = FRAME_HEADER.unpack(header)
+            output = stdout.read(length)
+            if len(output) < length:
+                break
+            try:
+                reply = orjson.loads(output)
+            except orjson.JSONDecodeError as e:
+                # Without its id the reply can't be matched; treat the stream as broken
+                logger.error(f"Failed to parse helper worker reply: {e}")
+                logger.error(f"Output: {output[:1000]!r}")
+                self.process.kill()
+                break
+            self.last_reply = time.monotonic()
+            with self._pending_lock:
+                future = self.pending.pop(reply.get("id"), None)
+            if future is not None:
+                future.set_result(reply.get("result"))
+
+        # The worker exited (or its pipe broke): fail everything still waiting on it
+        self._forget()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        with self._pending_lock:
+            pending, self.pending = self.pending, {}
+        for future in pending.values():
+            future.set_result(None)
+
+    def _forget(self):
+        """Stop routing new requests to this worker."""
+        global _worker
+        with _worker_lock:
+            if _worker is self:
+                _worker = None
+
+    def stop(self):
+        """Close stdin so the helper finishes its requests and exits; kill it if it doesn't."""
+        if self.process.poll() is not None:
+            return
+        try:
+            # Closing stdin ends the worker's request loop, which closes the browser
+            self.process.stdin.close()
+            self.process.wait(timeout=10)
+        except Exception:
+            self.process.kill()
+
+def _get_worker() -> HelperWorker:
+    """Return the running helper worker, starting a new one if needed. Caller holds _worker_lock."""
+    global _worker
+    if _worker is None or not _worker.alive():
+        _worker = HelperWorker()
+    return _worker
+
+def _stop_worker_locked():
+    """Stop the helper worker. Caller holds _worker_lock."""
+    global _worker
+    worker, _worker = _worker, None
+    if worker is not None:
+        worker.stop()
+
+def _arm_idle_timer_locked(delay: float):
+    """Start the idle timer. Caller holds _worker_lock."""
+    global _idle_timer
+    _idle_timer = threading.Timer(delay, _stop_if_idle)
+    _idle_timer.daemon = True
+    _idle_timer.start()
+
+def _stop_if_idle():
+    """Idle-timer callback: stop the worker, or check again later if it was busy or used since."""
+    global _idle_timer
+    with _worker_lock:
+        _idle_timer = None
+        if _worker is None:
+            return
+        remaining = WORKER_IDLE_TIMEOUT - (time.monotonic() - _last_used)
+        if _worker.pending or remaining > 0:
+            _arm_idle_timer_locked(remaining if remaining > 0 else WORKER_IDLE_TIMEOUT)
+            return
+        logger.info("Stopping idle helper worker")
+        _stop_worker_locked()
+
+def _touch_worker_locked():
+    """Record worker activity and arm the idle timer if it isn't running. Caller holds _worker_lock."""
+    global _last_used
+    _last_used = time.monotonic()
+    if _idle_timer is None and WORKER_IDLE_TIMEOUT > 0:
+        _arm_idle_timer_locked(WORKER_IDLE_TIMEOUT)
+
+def start():
+    """Start the helper worker ahead of the first request (called on application startup)."""
+    if not HELPER_SCRIPT.exists():
+        logger.error(f"Helper script not found at {HELPER_SCRIPT}")
+        return
+    with _worker_lock:
+        # The worker launches and warms up its browser as soon as it starts
+        _get_worker()
+        _touch_worker_locked()
+
+def shutdown():
+    """Stop the helper worker and its browser (called on application shutdown)."""
+    global _idle_timer
+    with _worker_lock:
+        if _idle_timer is not None:
+            _idle_timer.cancel()
+            _idle_timer = None
+        _stop_worker_locked()
+
+# Returned by _wait_for_reply when the worker was killed as hung
+_HUNG = object()
+
+def _wait_for_reply(worker: HelperWorker, future: Future):
     """
-    Analyze a URL for accessibility issues using Playwright in a separate process.
-    
-    Args:
-        url (str): The URL to analyze
-        wcag_options (dict, optional): WCAG version and level options
-        
-    Returns:
-        dict: Analysis results
+    Wait for a request's reply. While the request waits for a free slot in the
+    worker, other replies keep arriving; if none arrives for WORKER_REPLY_TIMEOUT
+    the worker is killed (failing its other requests too) and _HUNG is returned.
     """
-    logger.info(f"Analyzing URL: {url}")
-    
+    while True:
+        waited_from = time.monotonic()
+        try:
+            return future.result(timeout=WORKER_REPLY_TIMEOUT)
+        except FutureTimeoutError:
+            if worker.last_reply > waited_from:
+                continue
+            logger.error(f"Helper worker sent no reply for {WORKER_REPLY_TIMEOUT:g} seconds, killing it")
+            # The reader thread sees the pipe close and fails the remaining requests;
+            # the next call starts a fresh worker
+            worker.process.kill()
+            return _HUNG
+
+def _analyze(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Send one analysis request to the helper worker and wait for its result."""
     try:
         # Check if helper script exists
         if not HELPER_SCRIPT.exists():
@@ -36,48 +226,39 @@ def analyze_url(url: str, wcag_options: Optional[Dict[str, Any]] = None):
                 "error": f"Helper script not found at {HELPER_SCRIPT}",
                 "mode": "static_only"
             }
-        
-        # Create data object to pass to helper script
-        data = {
-            "url": url,
-            "wcag_options": wcag_options or {}
-        }
-        
-        # Run the helper script as a separate process
-        cmd = [sys.executable, str(HELPER_SCRIPT)]
-        logger.info(f"Running command: {' '.join(cmd)}")
-        
-        # Use subprocess.run to completely avoid asyncio
-        result = subprocess.run(
-            cmd,
-            input=json.dumps(data),
-            capture_output=True,
-            text=True,
-            check=False  # Don't raise exception on non-zero exit
-        )
-        
-        if result.returncode != 0:
-            logger.error(f"Helper script failed with exit code {result.returncode}")
-            logger.error(f"STDERR: {result.stderr}")
+
+        data["id"] = next(_request_ids)
+
+        with _worker_lock:
+            worker = _get_worker()
+            try:
+                future = worker.send(data)
+            except (BrokenPipeError, OSError) as e:
+                logger.error(f"Helper worker pipe failed: {e}")
+                future = None
+                _stop_worker_locked()
+            _touch_worker_locked()
+
+        # Wait outside the lock so other requests can be sent meanwhile
+        result = _wait_for_reply(worker, future) if future is not None else None
+        if result is _HUNG:
             return {
                 "success": False,
-                "error": result.stderr or "Unknown error in helper script",
+                "error": f"Helper worker stopped responding (no reply for {WORKER_REPLY_TIMEOUT:g} seconds)",
                 "mode": "static_only"
             }
-        
-        # Parse the JSON output
-        try:
-            return json.loads(result.stdout)
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse helper script output: {e}")
-            logger.error(f"Output: {result.stdout}")
+        if result is None:
+            # The worker died mid-request; the next call starts a fresh one
+            exit_code = worker.process.poll()
+            logger.error(f"Helper worker exited unexpectedly (exit code {exit_code})")
             return {
                 "success": False,
-                "error": f"Failed to parse results: {str(e)}",
+                "error": f"Helper worker exited unexpectedly (exit code {exit_code})",
                 "mode": "static_only"
             }
+        return result
     except Exception as e:
-        logger.error(f"Error analyzing URL: {e}")
+        logger.error(f"Error running analysis: {e}")
         import traceback
         logger.error(traceback.format_exc())
         return {
@@ -86,6 +267,42 @@ def analyze_url(url: str, wcag_options: Optional[Dict[str, Any]] = None):
             "mode": "static_only"
         }
 
+def analyze_url(url: str, wcag_options: Optional[Dict[str, Any]] = None):
+    """
+    Analyze a URL for accessibility issues using Playwright in a separate process.
+
+    Args:
+        url (str): The URL to analyze
+        wcag_options (dict, optional): WCAG version and level options
+
+    Returns:
+        dict: Analysis results
+    """
+    logger.info(f"Analyzing URL: {url}")
+    return _analyze({
+        "url": url,
+        "wcag_options": wcag_options or {}
+    })
+
+def analyze_html(html: str, wcag_options: Optional[Dict[str, Any]] = None):
+    """
+    Analyze an HTML document for accessibility issues using Playwright in a separate process.
+
+    The markup is loaded with page.set_content, so it is never wrapped in a data: URL.
+
+    Args:
+        html (str): The HTML document to analyze
+        wcag_options (dict, optional): WCAG version and level options
+
+    Returns:
+        dict: Analysis results
+    """
+    logger.info(f"Analyzing HTML content ({len(html)} characters)")
+    return _analyze({
+        "html": html,
+        "wcag_options": wcag_options or {}
+    })
+
 if __name__ == "__main__":
     # Simple command-line interface
     if len(sys.argv) > 1:
@@ -101,8 +318,9 @@ if __name__ == "__main__":
             print(f"Analysis failed: {results.get('error')}")
     else:
         # Read from stdin for JSON input
-        input_data = json.loads(sys.stdin.read())
+        input_data = orjson.loads(sys.stdin.buffer.read())
         url = input_data.get("url")
         wcag_options = input_data.get("wcag_options")
         results = analyze_url(url, wcag_options)
-        print(json.dumps(results)) 
\ No newline at end of file
+        print(orjson.dumps(results).decode("utf-8")) 
+    shutdown()
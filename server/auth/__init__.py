@@ -14,6 +14,7 @@ from .auth_utils import (
     verify_password,
     get_password_hash,
     get_user,
+    invalidate_cached_user,
     authenticate_user,
     create_access_token,
     get_current_user,
@@ -35,6 +36,7 @@ __all__ = [
     "verify_password",
     "get_password_hash",
     "get_user",
+    "invalidate_cached_user",
     "authenticate_user", 
     "create_access_token",
     "get_current_user",
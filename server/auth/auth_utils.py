@@ -1,9 +1,11 @@
 """Authentication utilities and functions (MongoDB + Motor)."""
 
 import os
+import time
 import secrets
 import jwt
 from datetime import datetime, timedelta
+from cachetools import TTLCache
 from passlib.context import CryptContext
 from fastapi import HTTPException, Depends, status
 from fastapi.security import OAuth2PasswordBearer
@@ -16,12 +18,30 @@ SECRET_KEY = os.environ.get("SECRET_KEY", secrets.token_hex(32))
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Password hashing: new hashes use argon2; existing bcrypt hashes still verify
+# and are upgraded to argon2 on the user's next successful login
+pwd_context = CryptContext(
+    schemes=["argon2", "bcrypt"],
+    default="argon2",
+    deprecated="auto",
+    argon2__time_cost=2,
+    argon2__memory_cost=19456,
+)
 
 # OAuth2 scheme
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# Recently verified tokens -> (email, exp). Clients send the same token on every
+# request, so its signature is checked once and then trusted until it expires
+# (or drops out of the cache)
+_verified_tokens = TTLCache(maxsize=10_000, ttl=60)
+
+# Users by email, so authenticated requests don't each pay a MongoDB round-trip.
+# Anything that changes a user document must call invalidate_cached_user().
+# Logins bypass it: the invalidation only reaches this process, and a stale
+# password hash must never be accepted.
+_user_cache = TTLCache(maxsize=1024, ttl=30)
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a password against its hash."""
     return pwd_context.verify(plain_password, hashed_password)
@@ -30,8 +50,8 @@ def get_password_hash(password: str) -> str:
     """Hash a password."""
     return pwd_context.hash(password)
 
-async def get_user(_unused_db: dict, email: str) -> Optional[UserInDB]:
-    """Get user by email from MongoDB. Signature keeps unused first param for backward compatibility."""
+async def _load_user(email: str) -> Optional[UserInDB]:
+    """Read a user straight from MongoDB, bypassing the lookup cache."""
     doc = await users_col.find_one({"email": email})
     if not doc:
         return None
@@ -42,13 +62,32 @@ async def get_user(_unused_db: dict, email: str) -> Optional[UserInDB]:
         "disabled": doc.get("disabled", False),
     })
 
+async def get_user(_unused_db: dict, email: str) -> Optional[UserInDB]:
+    """Get user by email from MongoDB. Signature keeps unused first param for backward compatibility."""
+    user = _user_cache.get(email)
+    if user is not None:
+        return user
+    user = await _load_user(email)
+    if user is not None:
+        _user_cache[email] = user
+    return user
+
+def invalidate_cached_user(email: str) -> None:
+    """Drop a user from the lookup cache after their document changed."""
+    _user_cache.pop(email, None)
+
 async def authenticate_user(_unused_db: dict, email: str, password: str) -> Union[UserInDB, bool]:
     """Authenticate user by email and password using MongoDB."""
-    user = await get_user(None, email)
+    user = await _load_user(email)
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    valid, new_hash = pwd_context.verify_and_update(password, user.hashed_password)
+    if not valid:
         return False
+    if new_hash:
+        await users_col.update_one({"email": email}, {"$set": {"hashed_password": new_hash}})
+        invalidate_cached_user(email)
+        user.hashed_password = new_hash
     return user
 
 def create_access_token(data: dict, expires_delta: timedelta = None) -> str:
@@ -66,13 +105,19 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
+    cached = _verified_tokens.get(token)
+    if cached and cached[1] > time.time():
+        email = cached[0]
+    else:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            email: str = payload.get("sub")
+            if email is None:
+                raise credentials_exception
+        except jwt.PyJWTError:
             raise credentials_exception
-    except jwt.PyJWTError:
-        raise credentials_exception
+        if "exp" in payload:
+            _verified_tokens[token] = (email, payload["exp"])
     user = await get_user(None, email=email)
     if user is None:
         raise credentials_exception
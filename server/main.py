@@ -1,6 +1,8 @@
 """FastAPI server for accessibility analysis - Refactored and modularized."""
 
 import os
+import asyncio
+import hashlib
 import platform
 import logging
 import uuid
@@ -14,17 +16,21 @@ from dotenv import load_dotenv
 load_dotenv()
 from fastapi import FastAPI, HTTPException, UploadFile, File, Depends, status, BackgroundTasks, Form
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from fastapi.security import OAuth2PasswordRequestForm
+from cachetools import TTLCache
+import orjson
 import uvicorn
 
 # Import our modular components
 from auth import (
     Token, User, UserCreate, PasswordResetRequest, PasswordReset,
     authenticate_user, create_access_token, get_current_active_user,
-    initialize_default_users,
+    get_password_hash, invalidate_cached_user, initialize_default_users,
     ACCESS_TOKEN_EXPIRE_MINUTES
 )
 from services.db import users as users_col, password_reset_tokens as prt_col, analyses as analyses_col
+from services.history_service import build_analysis_doc, queue_analysis, history_writer, stop_history_writer
 from services import (
     send_welcome_email, send_password_reset_email,
     initialize_gemini, chat_completion, explain_accessibility_issue,
@@ -36,6 +42,9 @@ from models import (
 
 # Analysis import (keeping the existing dynamic analysis)
 from analyzer.simple_playwright import analyze_url as playwright_analyze_url
+from analyzer.simple_playwright import analyze_html as playwright_analyze_html
+from analyzer.simple_playwright import start as playwright_start
+from analyzer.simple_playwright import shutdown as playwright_shutdown
 from bson import ObjectId
 
 # Load environment variables
@@ -45,6 +54,40 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Recent successful HTML analyses keyed by content and options, so repeating an
+# analysis skips Playwright entirely (ANALYSIS_CACHE_TTL=0 disables). URLs are
+# never cached: the page behind one changes as users fix it and re-check.
+ANALYSIS_CACHE_TTL = int(os.environ.get("ANALYSIS_CACHE_TTL", "600"))
+_analysis_cache = TTLCache(maxsize=128, ttl=ANALYSIS_CACHE_TTL) if ANALYSIS_CACHE_TTL > 0 else None
+
+# Largest HTML upload accepted by /analyze/file, in bytes
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(5 * 1024 * 1024)))
+
+# Seconds an analysis response waits for its history write before it is
+# returned without an id
+HISTORY_WRITE_TIMEOUT = float(os.environ.get("HISTORY_WRITE_TIMEOUT", "5"))
+
+async def run_cached_analysis(analyze, input_type: str, source: str, wcag_options):
+    """Run an analyzer function in a worker thread, reusing a recent identical HTML result."""
+    if _analysis_cache is None or input_type == "url":
+        return await asyncio.to_thread(analyze, source, wcag_options)
+
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(input_type.encode("utf-8") + b"\0")
+    digest.update(source.encode("utf-8") + b"\0")
+    digest.update(orjson.dumps(wcag_options, option=orjson.OPT_SORT_KEYS))
+    key = digest.hexdigest()
+
+    result = _analysis_cache.get(key)
+    if result is not None:
+        logger.info(f"Serving cached {input_type} analysis")
+        return result
+    result = await asyncio.to_thread(analyze, source, wcag_options)
+    # Failures (navigation errors, timeouts) are worth retrying, so only successes are kept
+    if isinstance(result, dict) and result.get("success"):
+        _analysis_cache[key] = result
+    return result
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifespan context manager for FastAPI application."""
@@ -62,17 +105,34 @@ async def lifespan(app: FastAPI):
     else:
         logger.warning("AI services initialization failed")
     
+    # Write analysis history in batches
+    history_task = asyncio.create_task(history_writer())
+    
+    # Start the Playwright helper worker so its browser is warm before the first analysis
+    try:
+        playwright_start()
+    except Exception as e:
+        logger.warning(f"Failed to start Playwright helper worker: {e}")
+    
     yield
     
     # Shutdown
     logger.info("Application shutting down")
+    
+    # Stop the Playwright helper worker (closes its browser)
+    playwright_shutdown()
+    
+    # Flush history that is still queued
+    await stop_history_writer(history_task)
 
 # Initialize FastAPI app
 app = FastAPI(
     title="Accessibility Analyzer API",
     description="A comprehensive accessibility analysis tool with AI-powered insights",
     version="2.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    # Analysis results are large nested axe payloads; orjson encodes them much faster
+    default_response_class=ORJSONResponse
 )
 
 # Add CORS middleware
@@ -125,7 +185,6 @@ async def register_user(user: UserCreate, background_tasks: BackgroundTasks):
         )
     
     # Create new user
-    from auth.auth_utils import get_password_hash
     await users_col.insert_one({
         "email": user.email,
         "full_name": user.full_name,
@@ -133,6 +192,7 @@ async def register_user(user: UserCreate, background_tasks: BackgroundTasks):
         "disabled": False,
         "created_at": datetime.utcnow(),
     })
+    invalidate_cached_user(user.email)
     
     # Send welcome email
     background_tasks.add_task(send_welcome_email, user.email, user.full_name)
@@ -195,8 +255,8 @@ async def reset_password(reset_data: PasswordReset):
         )
 
     # Update password
-    from auth.auth_utils import get_password_hash
     await users_col.update_one({"email": email}, {"$set": {"hashed_password": get_password_hash(reset_data.new_password)}})
+    invalidate_cached_user(email)
 
     # Remove used token
     await prt_col.delete_one({"token": reset_data.token})
@@ -212,72 +272,77 @@ async def read_users_me(current_user: User = Depends(get_current_active_user)):
 # ANALYSIS ENDPOINTS
 # ============================================================================
 
-@app.post("/analyze/url", tags=["Analysis"])
-async def analyze_url(request: URLAnalysisRequest, current_user: User = Depends(get_current_active_user)):
+async def _do_analyze(analyze, input_type: str, source: str, input_ref: str, wcag_options, user: User, label: str):
     """
-    Analyze a URL for accessibility issues.
-    
+    Run one analysis for an /analyze/* endpoint and store it in the history.
+
     Args:
-        request (URLAnalysisRequest): The analysis request containing the URL
-        
+        analyze: playwright_analyze_url or playwright_analyze_html
+        input_type (str): "url", "html" or "file"
+        source (str): The URL or HTML document handed to the analyzer
+        input_ref (str): What the history records as the input (URL, "inline_html" or file name)
+        wcag_options (dict, optional): WCAG options
+        user (User): The authenticated user
+        label (str): Describes the input in error messages, e.g. "the URL"
+
     Returns:
-        dict: Analysis results
+        dict: Analysis results, with the history id when it was stored
     """
     try:
-        logger.info(f"Analyzing URL: {request.url}")
-        
-        # Convert wcag_options to dict if provided
-        wcag_options = None
-        if request.wcag_options:
-            wcag_options = {
-                "wcag_version": request.wcag_options.wcag_version,
-                "level": request.wcag_options.level,
-                "best_practice": request.wcag_options.best_practice
-            }
-        
-        # Use dynamic analysis only
-        result = playwright_analyze_url(str(request.url), wcag_options)
+        # Use dynamic analysis only; the call blocks until the helper worker
+        # replies, so it runs off the event loop. Uploaded files share cache
+        # entries with identical inline HTML.
+        cache_type = "url" if input_type == "url" else "html"
+        result = await run_cached_analysis(analyze, cache_type, source, wcag_options)
         
         if result is None:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Analysis failed - unable to analyze the URL"
+                detail=f"Analysis failed - unable to analyze {label}"
             )
         
-        # Persist analysis for the authenticated user and return its id
+        # Persist via the batched history writer. The client opens /history/{id}
+        # as soon as it gets the response, so the id is only returned once the
+        # document has been written.
         try:
-            violations_count = (
-                result.get("violations_count")
-                if isinstance(result, dict)
-                else None
-            )
-            if violations_count is None and isinstance(result, dict):
-                violations = result.get("violations") or []
-                violations_count = len(violations) if isinstance(violations, list) else 0
-            insert_doc = {
-                "owner_email": current_user.email,
-                "input_type": "url",
-                "input_ref": str(request.url),
-                "wcag_options": wcag_options,
-                "violations_count": violations_count,
-                "summary": result.get("summary") if isinstance(result, dict) else None,
-                "result": result if isinstance(result, dict) else {"raw": result},
-                "created_at": datetime.utcnow(),
-            }
-            insert_res = await analyses_col.insert_one(insert_doc)
-            return {"id": str(insert_res.inserted_id), **result}
+            doc = build_analysis_doc(user.email, input_type, input_ref, wcag_options, result)
+            if await asyncio.wait_for(queue_analysis(doc), HISTORY_WRITE_TIMEOUT):
+                return {"id": str(doc["_id"]), **result}
+        except asyncio.TimeoutError:
+            logger.warning(f"Timed out persisting {input_type} analysis history")
         except Exception as e:
-            logger.warning(f"Failed to persist analysis history: {e}")
-            # Even if persistence fails, return the analysis result without id
-            return result
+            logger.warning(f"Failed to persist {input_type} analysis history: {e}")
+        # Even if persistence fails, return the analysis result without id
+        return result
         
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error analyzing URL {request.url}: {str(e)}")
+        logger.error(f"Error analyzing {label} ({input_ref}): {str(e)}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Analysis failed: {str(e)}"
         )
 
+@app.post("/analyze/url", tags=["Analysis"])
+async def analyze_url(request: URLAnalysisRequest, current_user: User = Depends(get_current_active_user)):
+    """
+    Analyze a URL for accessibility issues.
+    
+    Args:
+        request (URLAnalysisRequest): The analysis request containing the URL
+        
+    Returns:
+        dict: Analysis results
+    """
+    logger.info(f"Analyzing URL: {request.url}")
+    
+    # Convert wcag_options to dict if provided
+    wcag_options = request.wcag_options.model_dump() if request.wcag_options else None
+    
+    url = str(request.url)
+    return await _do_analyze(playwright_analyze_url, "url", url, url, wcag_options, current_user, "the URL")
+
 @app.post("/analyze/html", tags=["Analysis"])
 async def analyze_html(request: HTMLAnalysisRequest, current_user: User = Depends(get_current_active_user)):
     """
@@ -289,59 +354,14 @@ async def analyze_html(request: HTMLAnalysisRequest, current_user: User = Depend
     Returns:
         dict: Analysis results
     """
-    try:
-        logger.info("Analyzing HTML content")
-        
-        # Convert wcag_options to dict if provided
-        wcag_options = None
-        if request.wcag_options:
-            wcag_options = {
-                "wcag_version": request.wcag_options.wcag_version,
-                "level": request.wcag_options.level,
-                "best_practice": request.wcag_options.best_practice
-            }
-        
-        # Create data URL for dynamic analysis
-        import base64
-        html_bytes = request.content.encode('utf-8')
-        html_b64 = base64.b64encode(html_bytes).decode('utf-8')
-        data_url = f"data:text/html;base64,{html_b64}"
-        
-        # Use dynamic analysis with data URL
-        result = playwright_analyze_url(data_url, wcag_options)
-        
-        if result is None:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Analysis failed - unable to analyze the HTML content"
-            )
-        
-        # Persist + return id
-        try:
-            violations = result.get("violations") if isinstance(result, dict) else []
-            violations_count = len(violations) if isinstance(violations, list) else result.get("violations_count", 0)
-            insert_doc = {
-                "owner_email": current_user.email,
-                "input_type": "html",
-                "input_ref": "inline_html",
-                "wcag_options": wcag_options,
-                "violations_count": violations_count,
-                "summary": result.get("summary") if isinstance(result, dict) else None,
-                "result": result if isinstance(result, dict) else {"raw": result},
-                "created_at": datetime.utcnow(),
-            }
-            insert_res = await analyses_col.insert_one(insert_doc)
-            return {"id": str(insert_res.inserted_id), **result}
-        except Exception as e:
-            logger.warning(f"Failed to persist HTML analysis history: {e}")
-            return result
-        
-    except Exception as e:
-        logger.error(f"Error analyzing HTML content: {str(e)}")
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Analysis failed: {str(e)}"
-        )
+    logger.info("Analyzing HTML content")
+    
+    # Convert wcag_options to dict if provided
+    wcag_options = request.wcag_options.model_dump() if request.wcag_options else None
+    
+    # The helper loads the markup with page.set_content
+    return await _do_analyze(playwright_analyze_html, "html", request.content, "inline_html",
+                             wcag_options, current_user, "the HTML content")
 
 @app.post("/analyze/file", tags=["Analysis"])
 async def analyze_file(current_user: User = Depends(get_current_active_user), file: UploadFile = File(...), wcag_options: str = Form(None)):
@@ -355,69 +375,37 @@ async def analyze_file(current_user: User = Depends(get_current_active_user), fi
     Returns:
         dict: Analysis results
     """
-    try:
-        logger.info(f"Analyzing uploaded file: {file.filename}")
-        
-        # Validate file type
-        if not file.filename.lower().endswith(('.html', '.htm')):
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Only HTML files are supported"
-            )
-        
-        # Read file content
-        content = await file.read()
-        html_content = content.decode('utf-8')
-        
-        # Parse WCAG options if provided
-        parsed_wcag_options = None
-        if wcag_options:
-            try:
-                parsed_wcag_options = json.loads(wcag_options)
-            except json.JSONDecodeError:
-                logger.warning("Invalid WCAG options JSON, using defaults")
-        
-        # Create data URL for dynamic analysis
-        import base64
-        html_bytes = html_content.encode('utf-8')
-        html_b64 = base64.b64encode(html_bytes).decode('utf-8')
-        data_url = f"data:text/html;base64,{html_b64}"
-        
-        # Use dynamic analysis with data URL
-        result = playwright_analyze_url(data_url, parsed_wcag_options)
-        
-        if result is None:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Analysis failed - unable to analyze the uploaded file"
-            )
-        
-        # Persist + return id
-        try:
-            violations = result.get("violations") if isinstance(result, dict) else []
-            violations_count = len(violations) if isinstance(violations, list) else result.get("violations_count", 0)
-            insert_doc = {
-                "owner_email": current_user.email,
-                "input_type": "file",
-                "input_ref": file.filename,
-                "wcag_options": parsed_wcag_options,
-                "violations_count": violations_count,
-                "summary": result.get("summary") if isinstance(result, dict) else None,
-                "result": result if isinstance(result, dict) else {"raw": result},
-                "created_at": datetime.utcnow(),
-            }
-            insert_res = await analyses_col.insert_one(insert_doc)
-            return {"id": str(insert_res.inserted_id), **result}
-        except Exception as e:
-            logger.warning(f"Failed to persist file analysis history: {e}")
-            return result
-        
-    except Exception as e:
-        logger.error(f"Error analyzing file {file.filename}: {str(e)}")
+    logger.info(f"Analyzing uploaded file: {file.filename}")
+    
+    # Validate file type
+    if not file.filename.lower().endswith(('.html', '.htm')):
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Analysis failed: {str(e)}"
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Only HTML files are supported"
+        )
+    
+    # Read file content, refusing uploads over the size limit without
+    # buffering more than one byte past it
+    content = await file.read(MAX_UPLOAD_BYTES + 1)
+    if len(content) > MAX_UPLOAD_BYTES:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"File too large (limit {MAX_UPLOAD_BYTES} bytes)"
         )
+    # Tolerate stray non-UTF-8 bytes instead of failing the whole analysis
+    html_content = content.decode('utf-8', errors='replace')
+    
+    # Parse WCAG options if provided
+    parsed_wcag_options = None
+    if wcag_options:
+        try:
+            parsed_wcag_options = json.loads(wcag_options)
+        except json.JSONDecodeError:
+            logger.warning("Invalid WCAG options JSON, using defaults")
+    
+    # The helper loads the markup with page.set_content
+    return await _do_analyze(playwright_analyze_html, "file", html_content, file.filename,
+                             parsed_wcag_options, current_user, "the uploaded file")
 
 # ============================================================================
 # AI ENDPOINTS
@@ -475,12 +463,15 @@ async def health_check():
 @app.get("/history", tags=["History"])
 async def list_history(limit: int = 50, current_user: User = Depends(get_current_active_user)):
     """List recent analyses for the current user."""
-    cursor = analyses_col.find({"owner_email": current_user.email}).sort("created_at", -1).limit(max(1, min(limit, 200)))
-    items = []
-    async for doc in cursor:
-        doc["id"] = str(doc.get("_id"))
-        doc.pop("_id", None)
-        items.append(doc)
+    limit = max(1, min(limit, 200))
+    # The list only shows summary fields; the full axe result is served by /history/{item_id}
+    cursor = analyses_col.find(
+        {"owner_email": current_user.email},
+        projection={"result": 0}
+    ).sort("created_at", -1).limit(limit)
+    items = await cursor.to_list(length=limit)
+    for doc in items:
+        doc["id"] = str(doc.pop("_id"))
     return {"items": items}
 
 @app.get("/history/{item_id}", tags=["History"])
@@ -8,6 +8,8 @@ class WCAGOptions(BaseModel):
     wcag_version: str = "wcag21"
     level: str = "aa"
     best_practice: bool = True
+    wait_selector: Optional[str] = None
+    block_assets: bool = True
 
 class URLAnalysisRequest(BaseModel):
     """Request model for URL-based accessibility analysis."""
@@ -19,6 +19,12 @@ users = db["users"]
 password_reset_tokens = db["password_reset_tokens"]
 analyses = db["analyses"]
 
+# Demo accounts created on first start
+DEFAULT_USERS = [
+    {"email": "test@example.com", "full_name": "Test User", "password": "password123"},
+    {"email": "admin@example.com", "full_name": "Admin User", "password": "admin123"},
+]
+
 
 async def init_indexes():
     """Create required indexes (idempotent)."""
@@ -33,21 +39,22 @@ async def init_indexes():
 
 async def seed_default_users(get_password_hash):
     """Seed default users if not present."""
-    existing_test = await users.find_one({"email": "test@example.com"})
-    if not existing_test:
-        await users.insert_one({
-            "email": "test@example.com",
-            "full_name": "Test User",
-            "hashed_password": get_password_hash("password123"),
-            "disabled": False,
-            "created_at": datetime.utcnow(),
-        })
-    existing_admin = await users.find_one({"email": "admin@example.com"})
-    if not existing_admin:
+    # One round-trip to find which defaults already exist; passwords are only
+    # hashed (deliberately slow) for users that still need creating
+    existing = {
+        doc["email"]
+        async for doc in users.find(
+            {"email": {"$in": [user["email"] for user in DEFAULT_USERS]}},
+            {"email": 1}
+        )
+    }
+    for user in DEFAULT_USERS:
+        if user["email"] in existing:
+            continue
         await users.insert_one({
-            "email": "admin@example.com",
-            "full_name": "Admin User",
-            "hashed_password": get_password_hash("admin123"),
+            "email": user["email"],
+            "full_name": user["full_name"],
+            "hashed_password": get_password_hash(user["password"]),
             "disabled": False,
             "created_at": datetime.utcnow(),
         })
@@ -0,0 +1,120 @@
+"""Analysis history persistence: builds history documents and writes them to MongoDB in batches."""
+
+import os
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+from .db import analyses
+
+logger = logging.getLogger(__name__)
+
+# Largest insert_many batch
+HISTORY_BATCH_SIZE = int(os.environ.get("HISTORY_BATCH_SIZE", "50"))
+
+# (document, future) pairs waiting to be written; None tells the writer to flush and stop
+_queue: "asyncio.Queue[Optional[Tuple[Dict[str, Any], asyncio.Future]]]" = asyncio.Queue()
+
+
+def build_analysis_doc(
+    owner_email: str,
+    input_type: str,
+    input_ref: str,
+    wcag_options: Optional[Dict[str, Any]],
+    result: Any,
+) -> Dict[str, Any]:
+    """
+    Build the history document for one analysis, with a pre-generated _id.
+
+    Args:
+        owner_email (str): Email of the user who ran the analysis
+        input_type (str): "url", "html" or "file"
+        input_ref (str): The URL, "inline_html" or the uploaded file name
+        wcag_options (dict, optional): Options the analysis ran with
+        result: Analysis result returned by the analyzer
+
+    Returns:
+        dict: Document ready for queue_analysis()
+    """
+    violations_count = None
+    if isinstance(result, dict):
+        violations_count = result.get("violations_count")
+        if violations_count is None:
+            violations = result.get("violations") or []
+            violations_count = len(violations) if isinstance(violations, list) else 0
+    return {
+        "_id": ObjectId(),
+        "owner_email": owner_email,
+        "input_type": input_type,
+        "input_ref": input_ref,
+        "wcag_options": wcag_options,
+        "violations_count": violations_count,
+        "summary": result.get("summary") if isinstance(result, dict) else None,
+        "result": result if isinstance(result, dict) else {"raw": result},
+        "created_at": datetime.utcnow(),
+    }
+
+
+def queue_analysis(doc: Dict[str, Any]) -> "asyncio.Future[bool]":
+    """
+    Queue a history document for the background writer.
+
+    Returns:
+        asyncio.Future: Resolves to True once the document is stored, False if its write failed
+    """
+    future = asyncio.get_running_loop().create_future()
+    _queue.put_nowait((doc, future))
+    return future
+
+
+async def _insert_batch(batch: List[Tuple[Dict[str, Any], asyncio.Future]]):
+    failed = set()
+    try:
+        await analyses.insert_many([doc for doc, _ in batch], ordered=False)
+    except BulkWriteError as e:
+        # Unordered inserts carry on past a bad document; only the reported ones failed
+        failed = {error["index"] for error in e.details.get("writeErrors", [])}
+        logger.warning(f"Failed to persist {len(failed)} analysis history document(s): {e}")
+    except Exception as e:
+        failed = set(range(len(batch)))
+        logger.warning(f"Failed to persist {len(batch)} analysis history document(s): {e}")
+    for index, (_, future) in enumerate(batch):
+        if not future.done():
+            future.set_result(index not in failed)
+
+
+async def history_writer():
+    """
+    Drain the queue into insert_many batches until stop_history_writer() is called.
+
+    Each batch is written as soon as the writer picks it up; it holds whatever
+    was already queued, never waiting for more. A lone document therefore costs
+    one round-trip, while documents queued during a write (under concurrent
+    load) share the next one. Each queued document's future is resolved once
+    its batch has been written.
+    """
+    stopping = False
+    while not stopping:
+        item = await _queue.get()
+        if item is None:
+            break
+        batch = [item]
+        while len(batch) < HISTORY_BATCH_SIZE:
+            try:
+                item = _queue.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+            if item is None:
+                stopping = True
+                break
+            batch.append(item)
+        await _insert_batch(batch)
+
+
+async def stop_history_writer(task: asyncio.Task):
+    """Flush everything queued so far and wait for the writer task to finish."""
+    _queue.put_nowait(None)
+    await task
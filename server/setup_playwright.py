@@ -9,6 +9,7 @@ import sys
 import subprocess
 import platform
 import logging
+import urllib.request
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, 
@@ -50,7 +51,7 @@ def install_browser():
         else:
             # Get the path to playwright executable
             playwright_executable = os.path.join(os.path.dirname(sys.executable), 'playwright')
-        if not os.path.exists(playwright_executable):
+            if not os.path.exists(playwright_executable):
                 logger.warning(f"Playwright executable not found at {playwright_executable}, using module invocation")
                 cmd = [sys.executable, "-m", "playwright", "install", "chromium", "--with-deps"]
             else:
@@ -79,8 +80,31 @@ def install_browser():
         logger.error(traceback.format_exc())
         return False
 
+def download_axe_core():
+    """Download the pinned axe-core bundle that the analyzer preloads into each browser context."""
+    from analyzer.browser_pool import AXE_CDN_URL, AXE_PATH
+    
+    if AXE_PATH.exists():
+        logger.info(f"axe-core already present at {AXE_PATH}")
+        return True
+    
+    try:
+        logger.info(f"Downloading axe-core from {AXE_CDN_URL}...")
+        AXE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        with urllib.request.urlopen(AXE_CDN_URL, timeout=60) as response:
+            AXE_PATH.write_bytes(response.read())
+        logger.info(f"axe-core saved to {AXE_PATH}")
+        return True
+    except Exception as e:
+        logger.error(f"Failed to download axe-core: {e}")
+        return False
+
 def main():
     """Main setup function."""
+    # Only fetch the axe-core bundle (used by the Docker build, where browsers are preinstalled)
+    if "--axe-only" in sys.argv[1:]:
+        return 0 if download_axe_core() else 1
+    
     logger.info("Starting Playwright setup...")
     
     # Step 1: Install Playwright package
@@ -92,6 +116,10 @@ def main():
     if not install_browser():
         logger.error("Failed to install browser binaries")
         return 1
+    
+    # Step 3: Download axe-core (the analyzer falls back to the CDN without it)
+    if not download_axe_core():
+        logger.warning("axe-core download failed; analyses will load it from the CDN")
         
     logger.info("Playwright setup completed successfully!")
     logger.info("Run 'python test_playwright.py' to verify the installation.")